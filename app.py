@@ -1,24 +1,57 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, g
+from flask.json.provider import DefaultJSONProvider
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from flask_session import Session
 from werkzeug.utils import secure_filename
 import os
+import shutil
 import pickle
 import io
-from datetime import datetime
+import threading
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from config import Config
-from models import db, bcrypt, User, APIKey, ChatMessage, PDFDocument
+from models import db, bcrypt, utcnow, User, APIKey, ChatMessage, PDFDocument
+from embeddings import QuantizedEmbeddings
+from pdf_extract import extract_page_range
 
 # LangChain imports
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
 from langchain_groq import ChatGroq
 from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationTokenBufferMemory
 from langchain.prompts import PromptTemplate
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import RedisStore
 from PyPDF2 import PdfReader
+import pypdfium2 as pdfium
+import faiss
+import numpy as np
+import redis
+import ahocorasick
+from cachetools import LRUCache, TTLCache
+from rq import Queue
+import orjson
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Serialize JSON responses with orjson (datetimes and numpy arrays are encoded natively)"""
+    options = orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY
+    
+    def dumps(self, obj, **kwargs):
+        # Output is always compact; anything orjson can't encode goes through Flask's default hook
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.config.from_object(Config)
 
 # Initialize extensions
@@ -28,12 +61,47 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-# Create upload folder
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Create index folder
+os.makedirs(app.config['INDEX_FOLDER'], exist_ok=True)
 
-# Global storage for vector stores (in production, use Redis or similar)
-vector_stores = {}
-conversation_chains = {}
+class VectorStoreCache(LRUCache):
+    """LRU of (pdf_id, vector store) per user; evicting one also drops the user's chain, which holds the same index"""
+    
+    def popitem(self):
+        user_id, entry = super().popitem()
+        conversation_chains.pop(user_id, None)
+        return user_id, entry
+
+
+# Bounded in-memory storage for vector stores and conversation chains.
+# Indexes are persisted on creation, so evicted ones are simply reloaded from disk.
+# Evicting a store evicts its chain too, so VECTOR_STORE_CACHE_SIZE bounds the indexes in memory.
+vector_stores = VectorStoreCache(maxsize=app.config['VECTOR_STORE_CACHE_SIZE'])
+conversation_chains = TTLCache(maxsize=app.config['CHAIN_CACHE_SIZE'], ttl=app.config['CHAIN_CACHE_TTL'])
+_cache_lock = threading.RLock()  # Guards both caches (eviction touches both)
+
+# Shared Redis client (only used when REDIS_URL is configured)
+_redis_client = None
+
+def get_redis_client():
+    """Get cached Redis client, or None if Redis is not configured"""
+    global _redis_client
+    if _redis_client is None and app.config['REDIS_URL']:
+        _redis_client = redis.Redis.from_url(app.config['REDIS_URL'])
+    return _redis_client
+
+# Keep session data in Redis when available, so the cookie only carries the session id
+if app.config['REDIS_URL']:
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = get_redis_client()
+    Session(app)
+
+def get_pdf_queue():
+    """Get the background PDF processing queue, or None to process inline"""
+    redis_client = get_redis_client()
+    if redis_client is None:
+        return None
+    return Queue(app.config['PDF_QUEUE_NAME'], connection=redis_client)
 
 # Cache embeddings model globally for performance (load once)
 _embeddings_cache = None
@@ -44,16 +112,43 @@ def get_embeddings_model():
     if _embeddings_cache is None:
         print("Loading embeddings model (one-time initialization)...")
         import gc
-        _embeddings_cache = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True, 'batch_size': 32}
+        # INT8-quantized MiniLM on ONNX Runtime (exported on first run)
+        _embeddings_cache = QuantizedEmbeddings(
+            model_dir=app.config['EMBEDDINGS_MODEL_DIR'],
+            batch_size=128
         )
+        
+        # Reuse vectors of previously seen chunks (keyed by chunk hash) across uploads
+        redis_client = get_redis_client()
+        if redis_client is not None:
+            _embeddings_cache = CacheBackedEmbeddings.from_bytes_store(
+                _embeddings_cache,
+                RedisStore(client=redis_client, ttl=app.config['EMBEDDINGS_CACHE_TTL']),
+                namespace='all-MiniLM-L6-v2-int8'
+            )
         # Force garbage collection to free memory
         gc.collect()
         print("✓ Embeddings model loaded")
     return _embeddings_cache
 
+# Text splitter is stateless, so one instance is shared by every upload
+TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=1200,
+    chunk_overlap=200,
+    length_function=len
+)
+
+# Keywords that mark a chat message as a summary request, matched in a single pass
+SUMMARY_KEYWORDS = [
+    'summary', 'summarize', 'summarise', 'overview', 'main points',
+    'key points', 'what is the document about', 'what does the pdf say',
+    'résumé', 'resumen', 'zusammenfassung', 'riepilogo', 'خلاصة'
+]
+summary_keyword_matcher = ahocorasick.Automaton()
+for keyword in SUMMARY_KEYWORDS:
+    summary_keyword_matcher.add_word(keyword, keyword)
+summary_keyword_matcher.make_automaton()
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
@@ -63,41 +158,140 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
 
+def get_active_pdf(user_id):
+    """Get the user's active PDFDocument, or None (looked up once per request)"""
+    if 'active_pdfs' not in g:
+        g.active_pdfs = {}
+    if user_id not in g.active_pdfs:
+        g.active_pdfs[user_id] = PDFDocument.query.filter_by(user_id=user_id, is_active=True).first()
+    return g.active_pdfs[user_id]
+
+
 def get_active_api_key(user_id):
-    """Get the active Groq API key for the user"""
-    api_key = APIKey.query.filter_by(user_id=user_id, is_active=True).first()
-    return api_key.get_key_value() if api_key else None
+    """Get the active Groq API key for the user (looked up once per request)"""
+    if 'active_api_keys' not in g:
+        g.active_api_keys = {}
+    if user_id not in g.active_api_keys:
+        api_key = APIKey.query.filter_by(user_id=user_id, is_active=True).first()
+        g.active_api_keys[user_id] = api_key.get_key_value() if api_key else None
+    return g.active_api_keys[user_id]
+
+
+# Minimum pages per extraction worker, so process startup stays amortized
+PAGES_PER_WORKER = 16
+MAX_EXTRACTION_WORKERS = 4
+
+# pdfium is not thread-safe, so in-process calls from concurrent request threads take turns
+_pdfium_lock = threading.Lock()
+
+# Don't fork this process (it holds ONNX Runtime threads and FAISS indexes): start extraction
+# workers from a forkserver with pdf_extract preloaded (spawn where forkserver is unavailable)
+if 'forkserver' in multiprocessing.get_all_start_methods():
+    EXTRACTION_CONTEXT = multiprocessing.get_context('forkserver')
+    EXTRACTION_CONTEXT.set_forkserver_preload(['__main__', 'pdf_extract'])
+else:
+    EXTRACTION_CONTEXT = multiprocessing.get_context('spawn')
+
+
+def extract_pages_in_parallel(pdf_data, page_count, workers):
+    """Split the pages into contiguous ranges and extract them in worker processes"""
+    # pdfium is not thread-safe, so each range runs in a separate process.
+    # Workers open the PDF from a temp file instead of each receiving a pickled copy of the bytes.
+    bounds = [page_count * i // workers for i in range(workers + 1)]
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as pdf_file:
+        pdf_file.write(pdf_data)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=EXTRACTION_CONTEXT) as executor:
+            ranges = executor.map(extract_page_range, [pdf_file.name] * workers, bounds[:-1], bounds[1:])
+            return [text for page_texts in ranges for text in page_texts]
+    finally:
+        os.unlink(pdf_file.name)
 
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF file"""
-    text = ""
+def extract_text_from_pdf(pdf_data):
+    """Extract text and page count from in-memory PDF bytes using native pdfium"""
+    with _pdfium_lock:
+        try:
+            pdf = pdfium.PdfDocument(pdf_data)
+        except pdfium.PdfiumError:
+            pdf = None
+        else:
+            page_count = len(pdf)
+            workers = min(os.cpu_count() or 1, MAX_EXTRACTION_WORKERS, page_count // PAGES_PER_WORKER)
+            try:
+                if workers <= 1:
+                    text_parts = [page.get_textpage().get_text_range() for page in pdf]
+                    return "\n".join(text_parts), page_count
+            except Exception as e:
+                print(f"Error extracting text from PDF: {e}")
+                return "", page_count
+            finally:
+                pdf.close()
+    
+    if pdf is None:
+        # pdfium refused the file, try the pure-Python parser instead
+        return extract_text_with_pypdf2(pdf_data)
+    
+    # Large PDFs are extracted in worker processes, so the lock isn't held meanwhile
     try:
-        pdf_reader = PdfReader(pdf_path)
+        text_parts = extract_pages_in_parallel(pdf_data, page_count, workers)
+        return "\n".join(text_parts), page_count
+    except Exception as e:
+        print(f"Error extracting text from PDF: {e}")
+        return "", page_count
+
+
+def extract_text_with_pypdf2(pdf_data):
+    """Fallback text extraction with PyPDF2"""
+    text_parts = []
+    page_count = 0
+    try:
+        pdf_reader = PdfReader(io.BytesIO(pdf_data), strict=False)
+        page_count = len(pdf_reader.pages)
         for page in pdf_reader.pages:
-            text += page.extract_text()
+            text_parts.append(page.extract_text() or "")
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
-    return text
+    return "\n".join(text_parts), page_count
+
 
+def build_faiss_index(chunks, vectors, embeddings):
+    """Build a FAISS store backed by an HNSW graph index over FP16-encoded vectors"""
+    matrix = np.asarray(vectors, dtype='float32')
+    
+    # FP16 storage halves index memory; recall loss is negligible for normalized MiniLM vectors
+    index = faiss.IndexHNSWSQ(matrix.shape[1], faiss.ScalarQuantizer.QT_fp16, 32)
+    index.hnsw.efConstruction = 80
+    index.train(matrix)
+    index.add(matrix)
+    index.hnsw.efSearch = 64
+    
+    docstore = InMemoryDocstore({str(i): Document(page_content=chunk) for i, chunk in enumerate(chunks)})
+    index_to_docstore_id = {i: str(i) for i in range(len(chunks))}
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
 
-def create_vector_store(text, user_id):
-    """Create FAISS vector store from text quickly using cached embeddings"""
+
+def get_index_path(pdf_id):
+    """Directory where the FAISS index of a PDF is persisted"""
+    return os.path.join(app.config['INDEX_FOLDER'], str(pdf_id))
+
+
+def create_vector_store(chunks, user_id, pdf_id, index_path=None):
+    """Create FAISS vector store from text chunks quickly using cached embeddings"""
     try:
-        # Split text into optimized chunks for speed and quality
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1200,
-            chunk_overlap=200,
-            length_function=len
-        )
-        chunks = text_splitter.split_text(text)
-        
         # Use cached embeddings model for speed
         embeddings = get_embeddings_model()
         
-        # Create vector store (fast operation with cached model)
-        vector_store = FAISS.from_texts(chunks, embeddings)
-        vector_stores[user_id] = vector_store
+        # Encode all chunks in one call, then build the index from the vectors
+        vectors = embeddings.embed_documents(chunks)
+        vector_store = build_faiss_index(chunks, vectors, embeddings)
+        
+        # Persist so selecting this PDF again skips splitting and embedding
+        if index_path:
+            vector_store.save_local(index_path)
+        
+        with _cache_lock:
+            vector_stores[user_id] = (pdf_id, vector_store)
         
         return True
     except Exception as e:
@@ -105,6 +299,69 @@ def create_vector_store(text, user_id):
         return False
 
 
+def load_vector_store(index_path, user_id, pdf_id):
+    """Load a persisted FAISS vector store from disk"""
+    try:
+        vector_store = FAISS.load_local(index_path, get_embeddings_model())
+        with _cache_lock:
+            vector_stores[user_id] = (pdf_id, vector_store)
+        return True
+    except Exception as e:
+        print(f"Error loading vector store: {e}")
+        return False
+
+
+def load_or_rebuild_vector_store(pdf_doc, user_id):
+    """Load a PDF's persisted index, rebuilding it from the stored chunks if it is not on this machine"""
+    if pdf_doc.vector_store_path and os.path.isdir(pdf_doc.vector_store_path) \
+            and load_vector_store(pdf_doc.vector_store_path, user_id, pdf_doc.id):
+        return True
+    
+    # Missing here, e.g. written by a background worker with its own disk
+    index_path = get_index_path(pdf_doc.id)
+    if not create_vector_store(pdf_doc.get_chunk_texts(), user_id, pdf_doc.id, index_path):
+        return False
+    if pdf_doc.vector_store_path != index_path:
+        pdf_doc.vector_store_path = index_path
+        db.session.commit()
+    return True
+
+
+def get_vector_store(user_id):
+    """Get the vector store of the user's active PDF, reloading (or rebuilding) it if it is not in memory"""
+    pdf_doc = get_active_pdf(user_id)
+    with _cache_lock:
+        entry = vector_stores.get(user_id)
+        if entry is not None and (pdf_doc is None or entry[0] != pdf_doc.id):
+            # The active PDF changed elsewhere (e.g. a background job finished), drop the stale state
+            vector_stores.pop(user_id, None)
+            conversation_chains.pop(user_id, None)
+            entry = None
+    if entry is not None:
+        return entry[1]
+    if pdf_doc is None:
+        return None
+    
+    # A cached chain was built without this index, recreate it along with the store
+    drop_conversation_chain(user_id)
+    if load_or_rebuild_vector_store(pdf_doc, user_id):
+        with _cache_lock:
+            entry = vector_stores.get(user_id)
+    return entry[1] if entry is not None else None
+
+
+def drop_vector_store(user_id):
+    """Remove the user's vector store from memory"""
+    with _cache_lock:
+        vector_stores.pop(user_id, None)
+
+
+def drop_conversation_chain(user_id):
+    """Remove the user's conversation chain so it is recreated on next chat"""
+    with _cache_lock:
+        conversation_chains.pop(user_id, None)
+
+
 def get_language_instruction(language):
     """Get language-specific instruction for the prompt"""
     language_map = {
@@ -139,7 +396,8 @@ def create_conversation_chain(user_id, language='English'):
         language_instruction = get_language_instruction(language)
         
         # Check if user has uploaded a PDF
-        if user_id in vector_stores:
+        vector_store = get_vector_store(user_id)
+        if vector_store is not None:
             # PDF-based QA with comprehensive retrieval
             template = f"""You are a helpful AI assistant. {language_instruction}
             Use the following context from the uploaded PDF document to answer the question comprehensively.
@@ -159,7 +417,10 @@ def create_conversation_chain(user_id, language='English'):
                 input_variables=["context", "chat_history", "question"]
             )
             
-            memory = ConversationBufferMemory(
+            # Only the most recent ~2000 tokens of history are sent back to the LLM
+            memory = ConversationTokenBufferMemory(
+                llm=llm,
+                max_token_limit=2000,
                 memory_key="chat_history",
                 return_messages=True,
                 output_key="answer"
@@ -168,7 +429,7 @@ def create_conversation_chain(user_id, language='English'):
             # Use more chunks for better coverage (15 chunks)
             chain = ConversationalRetrievalChain.from_llm(
                 llm=llm,
-                retriever=vector_stores[user_id].as_retriever(search_kwargs={"k": 8}),
+                retriever=vector_store.as_retriever(search_kwargs={"k": 8}),
                 memory=memory,
                 combine_docs_chain_kwargs={"prompt": prompt},
                 return_source_documents=False
@@ -191,7 +452,9 @@ def create_conversation_chain(user_id, language='English'):
                 input_variables=["chat_history", "question"]
             )
             
-            memory = ConversationBufferMemory(
+            memory = ConversationTokenBufferMemory(
+                llm=llm,
+                max_token_limit=2000,
                 memory_key="chat_history",
                 return_messages=True
             )
@@ -202,7 +465,8 @@ def create_conversation_chain(user_id, language='English'):
                 memory=memory
             )
         
-        conversation_chains[user_id] = chain
+        with _cache_lock:
+            conversation_chains[user_id] = chain
         return chain
     
     except Exception as e:
@@ -210,6 +474,72 @@ def create_conversation_chain(user_id, language='English'):
         return None
 
 
+def process_pdf(pdf_data, user_id, filename, original_filename):
+    """Extract, store and index an uploaded PDF; returns (result dict, status code)"""
+    try:
+        # Extract text and count pages
+        text, page_count = extract_text_from_pdf(pdf_data)
+        
+        if not text or len(text.strip()) < 100:
+            return {'success': False, 'message': 'Could not extract text from PDF'}, 400
+        
+        file_size = len(pdf_data)
+        
+        # Split text into optimized chunks for speed and quality
+        chunks = TEXT_SPLITTER.split_text(text)
+        
+        # Deactivate all other PDFs for this user
+        PDFDocument.query.filter_by(user_id=user_id).update({'is_active': False})
+        
+        # Save PDF to database
+        pdf_doc = PDFDocument(
+            user_id=user_id,
+            filename=filename,
+            original_filename=original_filename,
+            file_size=file_size,
+            page_count=page_count,
+            is_active=True
+        )
+        db.session.add(pdf_doc)
+        db.session.flush()  # Assigns pdf_doc.id for the chunk rows
+        pdf_doc.save_chunks(chunks)
+        db.session.commit()
+        
+        # Create vector store and persist it next to the PDF record
+        index_path = get_index_path(pdf_doc.id)
+        success = create_vector_store(chunks, user_id, pdf_doc.id, index_path)
+        
+        if success:
+            pdf_doc.vector_store_path = index_path
+            db.session.commit()
+            
+            return {
+                'success': True,
+                'message': 'PDF processed successfully',
+                'filename': filename,
+                'pdf_id': pdf_doc.id
+            }, 200
+        else:
+            pdf_doc.delete_chunks()
+            db.session.delete(pdf_doc)
+            db.session.commit()
+            return {'success': False, 'message': 'Error processing PDF'}, 500
+    
+    except Exception as e:
+        db.session.rollback()
+        return {'success': False, 'message': f'Error: {str(e)}'}, 500
+
+
+def process_pdf_job(pdf_data, user_id, filename, original_filename):
+    """RQ job: process an uploaded PDF in the worker process"""
+    with app.app_context():
+        result, _ = process_pdf(pdf_data, user_id, filename, original_filename)
+        # The web process loads the persisted index itself, or rebuilds it from
+        # the stored chunks when the worker runs on another machine
+        drop_vector_store(user_id)
+        return result
+
+
 # ============= ROUTES =============
 
 @app.route('/')
@@ -272,6 +602,9 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and user.check_password(password):
+            # Persist the upgraded hash if check_password rehashed a legacy one
+            if db.session.is_modified(user):
+                db.session.commit()
             login_user(user)
             return jsonify({'success': True, 'message': 'Login successful'})
         else:
@@ -285,10 +618,8 @@ def login():
 def logout():
     """User logout"""
     # Clean up user's vector store and conversation chain
-    if current_user.id in vector_stores:
-        del vector_stores[current_user.id]
-    if current_user.id in conversation_chains:
-        del conversation_chains[current_user.id]
+    drop_vector_store(current_user.id)
+    drop_conversation_chain(current_user.id)
     
     logout_user()
     return redirect(url_for('index'))
@@ -328,7 +659,7 @@ def get_api_keys():
             'label': key.label,
             'masked_key': key.get_masked_key(),
             'is_active': key.is_active,
-            'created_at': key.created_at.isoformat()
+            'created_at': key.created_at
         } for key in keys]
     })
 
@@ -366,21 +697,30 @@ def add_api_key():
 def activate_api_key(key_id):
     """Set an API key as active"""
     try:
-        # Deactivate all keys
-        APIKey.query.filter_by(user_id=current_user.id).update({'is_active': False})
-        
-        # Activate the selected key
-        api_key = APIKey.query.filter_by(id=key_id, user_id=current_user.id).first()
-        if api_key:
-            api_key.is_active = True
+        # Deactivate the current key first: the one-active-key unique index is checked
+        # row by row, so a single CASE UPDATE could trip it halfway through
+        db.session.execute(
+            db.update(APIKey)
+            .where(APIKey.user_id == current_user.id, APIKey.is_active, APIKey.id != key_id)
+            .values(is_active=False)
+            .execution_options(synchronize_session=False)
+        )
+        # Activate the selected key (matches nothing if it isn't the user's)
+        result = db.session.execute(
+            db.update(APIKey)
+            .where(APIKey.id == key_id, APIKey.user_id == current_user.id)
+            .values(is_active=True)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
             db.session.commit()
             
             # Reset conversation chain to use new key
-            if current_user.id in conversation_chains:
-                del conversation_chains[current_user.id]
+            drop_conversation_chain(current_user.id)
             
             return jsonify({'success': True, 'message': 'API key activated'})
         else:
+            db.session.rollback()
             return jsonify({'success': False, 'message': 'API key not found'}), 404
     except Exception as e:
         db.session.rollback()
@@ -428,69 +768,57 @@ def upload_pdf():
     if not allowed_file(file.filename):
         return jsonify({'success': False, 'message': 'Only PDF files are allowed'}), 400
     
-    try:
-        # Save file temporarily
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{current_user.id}_{filename}")
-        file.save(filepath)
-        
-        # Extract text and count pages
-        text = extract_text_from_pdf(filepath)
-        
-        if not text or len(text.strip()) < 100:
-            os.remove(filepath)
-            return jsonify({'success': False, 'message': 'Could not extract text from PDF'}), 400
-        
-        # Get page count
-        pdf_reader = PdfReader(filepath)
-        page_count = len(pdf_reader.pages)
-        file_size = os.path.getsize(filepath)
-        
-        # Deactivate all other PDFs for this user
-        PDFDocument.query.filter_by(user_id=current_user.id).update({'is_active': False})
-        
-        # Save PDF to database
-        pdf_doc = PDFDocument(
-            user_id=current_user.id,
-            filename=filename,
-            original_filename=file.filename,
-            file_size=file_size,
-            page_count=page_count,
-            text_content=text,
-            is_active=True
+    # Parse straight from memory (large PDFs only touch disk as a temp file for the extraction workers)
+    filename = secure_filename(file.filename)
+    pdf_data = file.read()
+    
+    queue = get_pdf_queue()
+    if queue is not None:
+        # Process in the background worker and let the client poll /api/jobs/<id>
+        # The old PDF stays active (and its state cached) until the job finishes
+        # Referenced by import path so the worker resolves it even when app.py runs as __main__
+        job = queue.enqueue(
+            'app.process_pdf_job', pdf_data, current_user.id, filename, file.filename,
+            job_timeout=app.config['PDF_JOB_TIMEOUT'],
+            meta={'user_id': current_user.id}
         )
-        db.session.add(pdf_doc)
-        db.session.commit()
-        
-        # Create vector store (fast - text stays in DB for later recreation)
-        success = create_vector_store(text, current_user.id)
-        
-        if success:
-            # Reset conversation chain
-            if current_user.id in conversation_chains:
-                del conversation_chains[current_user.id]
-            
-            # Store PDF info in session
-            session['current_pdf'] = filename
-            session['current_pdf_id'] = pdf_doc.id
-            
-            # Clean up temporary file
-            os.remove(filepath)
-            
-            return jsonify({
-                'success': True,
-                'message': 'PDF processed successfully',
-                'filename': filename,
-                'pdf_id': pdf_doc.id
-            })
-        else:
-            db.session.delete(pdf_doc)
-            db.session.commit()
-            os.remove(filepath)
-            return jsonify({'success': False, 'message': 'Error processing PDF'}), 500
+        return jsonify({'success': True, 'message': 'PDF queued for processing', 'job_id': job.id}), 202
     
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+    # No Redis configured, process inline; the old PDF is about to be replaced, drop its in-memory state
+    drop_vector_store(current_user.id)
+    drop_conversation_chain(current_user.id)
+    result, status_code = process_pdf(pdf_data, current_user.id, filename, file.filename)
+    if result['success']:
+        session['current_pdf'] = result['filename']
+        session['current_pdf_id'] = result['pdf_id']
+    return jsonify(result), status_code
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job_status(job_id):
+    """Get the status of a background PDF processing job"""
+    queue = get_pdf_queue()
+    job = queue.fetch_job(job_id) if queue is not None else None
+    
+    if not job or job.meta.get('user_id') != current_user.id:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    
+    status = job.get_status()
+    if status == 'finished':
+        result = job.return_value()
+        if result['success']:
+            # The worker built the index on disk, load it on next chat
+            drop_vector_store(current_user.id)
+            drop_conversation_chain(current_user.id)
+            session['current_pdf'] = result['filename']
+            session['current_pdf_id'] = result['pdf_id']
+        return jsonify(dict(result, status=status))
+    
+    if status in ('failed', 'stopped', 'canceled'):
+        return jsonify({'success': False, 'status': status, 'message': 'Error processing PDF'})
+    
+    return jsonify({'success': True, 'status': status})
 
 
 @app.route('/api/chat', methods=['POST'])
@@ -515,29 +843,32 @@ def chat():
     try:
         print(f"[CHAT] User {current_user.id} sent message: {message[:50]}...")
         print(f"[CHAT] Language: {language}")
-        print(f"[CHAT] Has vector store: {current_user.id in vector_stores}")
-        print(f"[CHAT] Has conversation chain: {current_user.id in conversation_chains}")
+        vector_store = get_vector_store(current_user.id)
+        with _cache_lock:
+            chain = conversation_chains.get(current_user.id)
+        print(f"[CHAT] Has vector store: {vector_store is not None}")
+        print(f"[CHAT] Has conversation chain: {chain is not None}")
         # Recreate chain if language changed or doesn't exist
         # This ensures language changes are respected mid-conversation
-        chain = conversation_chains.get(current_user.id)
         if not chain or session.get('last_language') != language:
             chain = create_conversation_chain(current_user.id, language)
             session['last_language'] = language
             if not chain:
                 return jsonify({'success': False, 'message': 'Error initializing chat'}), 500
+        else:
+            # TTLCache counts from insertion, re-store so the chain only expires after inactivity
+            with _cache_lock:
+                conversation_chains[current_user.id] = chain
         
         # Detect if user is asking for a summary
-        is_summary_request = any(keyword in message.lower() for keyword in 
-                                ['summary', 'summarize', 'summarise', 'overview', 'main points', 
-                                 'key points', 'what is the document about', 'what does the pdf say',
-                                 'résumé', 'resumen', 'zusammenfassung', 'riepilogo', 'خلاصة'])
+        is_summary_request = next(summary_keyword_matcher.iter(message.lower()), None) is not None
         
         # Get response
-        if current_user.id in vector_stores:
+        if vector_store is not None:
             # PDF-based QA
             if is_summary_request:
                 # For summaries, use more chunks for comprehensive coverage (balanced for speed)
-                retriever = vector_stores[current_user.id].as_retriever(search_kwargs={"k": 20})
+                retriever = vector_store.as_retriever(search_kwargs={"k": 20})
                 chain.retriever = retriever
             
             response = chain({"question": message})
@@ -547,33 +878,33 @@ def chat():
             response = chain.run(question=message, chat_history="")
             answer = response
         
-        # Save messages to database
-        pdf_name = session.get('current_pdf')
-        
-        user_message = ChatMessage(
-            user_id=current_user.id,
-            role='user',
-            message=message,
-            language=language,
-            pdf_name=pdf_name
-        )
+        # Save both messages to database in a single multi-row INSERT
+        # (named after the active PDF, the session may predate a background upload)
+        active_pdf = get_active_pdf(current_user.id)
+        pdf_name = active_pdf.filename if active_pdf else None
         
-        assistant_message = ChatMessage(
-            user_id=current_user.id,
-            role='assistant',
-            message=answer,
-            language=language,
-            pdf_name=pdf_name
-        )
-        
-        db.session.add(user_message)
-        db.session.add(assistant_message)
+        ChatMessage.bulk_add([
+            {
+                'user_id': current_user.id,
+                'role': 'user',
+                'message': message,
+                'language': language,
+                'pdf_name': pdf_name
+            },
+            {
+                'user_id': current_user.id,
+                'role': 'assistant',
+                'message': answer,
+                'language': language,
+                'pdf_name': pdf_name
+            }
+        ])
         db.session.commit()
         
         return jsonify({
             'success': True,
             'response': answer,
-            'has_pdf_context': current_user.id in vector_stores
+            'has_pdf_context': vector_store is not None
         })
     
     except Exception as e:
@@ -587,10 +918,8 @@ def chat():
 @login_required
 def clear_pdf():
     """Clear the current PDF context"""
-    if current_user.id in vector_stores:
-        del vector_stores[current_user.id]
-    if current_user.id in conversation_chains:
-        del conversation_chains[current_user.id]
+    drop_vector_store(current_user.id)
+    drop_conversation_chain(current_user.id)
     if 'current_pdf' in session:
         del session['current_pdf']
     if 'current_pdf_id' in session:
@@ -626,20 +955,22 @@ def select_pdf(pdf_id):
         return jsonify({'success': False, 'message': 'PDF not found'}), 404
     
     try:
-        # Deactivate all other PDFs
-        PDFDocument.query.filter_by(user_id=current_user.id).update({'is_active': False})
-        
-        # Activate selected PDF
+        # Deactivate the current PDF before activating the selected one (one-active-PDF index)
+        db.session.execute(
+            db.update(PDFDocument)
+            .where(PDFDocument.user_id == current_user.id, PDFDocument.is_active, PDFDocument.id != pdf_doc.id)
+            .values(is_active=False)
+            .execution_options(synchronize_session=False)
+        )
         pdf_doc.is_active = True
-        pdf_doc.last_accessed = datetime.utcnow()
+        pdf_doc.last_accessed = utcnow()
         db.session.commit()
         
-        # Recreate vector store from text (fast with cached embeddings)
-        create_vector_store(pdf_doc.text_content, current_user.id)
+        # Load the persisted index, rebuilding it from the stored chunks only if it is missing
+        load_or_rebuild_vector_store(pdf_doc, current_user.id)
         
         # Reset conversation chain
-        if current_user.id in conversation_chains:
-            del conversation_chains[current_user.id]
+        drop_conversation_chain(current_user.id)
         
         # Update session
         session['current_pdf'] = pdf_doc.filename
@@ -666,18 +997,21 @@ def delete_pdf(pdf_id):
     
     try:
         # Clear from memory if it's the active one
-        if pdf_doc.is_active and current_user.id in vector_stores:
-            del vector_stores[current_user.id]
-            if current_user.id in conversation_chains:
-                del conversation_chains[current_user.id]
+        if pdf_doc.is_active:
+            drop_vector_store(current_user.id)
+            drop_conversation_chain(current_user.id)
             if 'current_pdf' in session:
                 del session['current_pdf']
             if 'current_pdf_id' in session:
                 del session['current_pdf_id']
         
-        # Delete from database
+        # Delete from database (chunks included) and drop the persisted index
+        index_path = pdf_doc.vector_store_path
+        pdf_doc.delete_chunks()
         db.session.delete(pdf_doc)
         db.session.commit()
+        if index_path:
+            shutil.rmtree(index_path, ignore_errors=True)
         
         return jsonify({'success': True, 'message': 'PDF deleted successfully'})
     
@@ -693,7 +1027,7 @@ def get_history():
     per_page = request.args.get('per_page', 50, type=int)
     
     messages = ChatMessage.query.filter_by(user_id=current_user.id)\
-        .order_by(ChatMessage.timestamp.desc())\
+        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())\
         .paginate(page=page, per_page=per_page, error_out=False)
     
     return jsonify({
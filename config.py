@@ -1,14 +1,50 @@
 import os
+import functools
+import secrets
+import tempfile
 from dotenv import load_dotenv
 
-load_dotenv()
 
-class Config:
-    """Base configuration"""
-    SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
+@functools.lru_cache(maxsize=1)
+def _load_env():
+    """Parse the .env file once and snapshot the environment"""
+    load_dotenv()
+    return dict(os.environ)
+
+
+_ENV = _load_env()
+SECRETS_FOLDER = _ENV.get('SECRETS_FOLDER', '.secrets')
+
+
+def get_or_create_secret(name, generate):
+    """Return a secret from the environment, else from SECRETS_FOLDER (generated and saved on first run)"""
+    value = _ENV.get(name)
+    if value:
+        return value
     
-    # Database configuration
-    database_url = os.getenv('DATABASE_URL', 'sqlite:///app.db')
+    path = os.path.join(SECRETS_FOLDER, name)
+    if not os.path.exists(path):
+        os.makedirs(SECRETS_FOLDER, mode=0o700, exist_ok=True)
+        # Write to a private temp file and link it into place, so concurrent workers agree on one value
+        fd, tmp_path = tempfile.mkstemp(dir=SECRETS_FOLDER)  # Created with mode 0600
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(generate())
+            os.link(tmp_path, path)
+            print(f"Generated {name} and saved it to {path}")
+        except FileExistsError:
+            pass  # Another process created it first
+        finally:
+            os.unlink(tmp_path)
+    
+    with open(path) as f:
+        return f.read().strip()
+
+
+@functools.cache
+def _resolve_database_url():
+    """Normalize DATABASE_URL once (Railway fixes, SQLite fallback)"""
+    database_url = _ENV.get('DATABASE_URL', 'sqlite:///app.db')
     
     # Fix for Railway PostgreSQL URL compatibility
     if database_url.startswith('postgres://'):
@@ -33,22 +69,54 @@ class Config:
         print("="*70 + "\n")
         database_url = 'sqlite:///app.db'
     
-    SQLALCHEMY_DATABASE_URI = database_url
+    return database_url
+
+
+DATABASE_URL = _resolve_database_url()
+
+# Conditional engine options (SQLite doesn't support pooling)
+if DATABASE_URL.startswith('sqlite'):
+    ENGINE_OPTIONS = {
+        'connect_args': {'check_same_thread': False},
+    }
+else:
+    ENGINE_OPTIONS = {
+        'pool_size': int(_ENV.get('DB_POOL_SIZE', 20)),
+        'max_overflow': 10,
+        'pool_recycle': 300,
+        'pool_pre_ping': _ENV.get('DB_PRE_PING', '0') == '1',  # Opt-in, costs a round-trip per checkout
+        'pool_use_lifo': True,  # Reuse the most recently used (warm) connection
+        'connect_args': {'options': '-c statement_timeout=30000'},  # ms
+    }
+
+
+class Config:
+    """Base configuration"""
+    SECRET_KEY = get_or_create_secret('SECRET_KEY', lambda: secrets.token_hex(32))
+    
+    # Database configuration
+    SQLALCHEMY_DATABASE_URI = DATABASE_URL
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = ENGINE_OPTIONS
     
-    # Conditional engine options (SQLite doesn't support pooling)
-    if database_url.startswith('sqlite'):
-        SQLALCHEMY_ENGINE_OPTIONS = {}
-    else:
-        SQLALCHEMY_ENGINE_OPTIONS = {
-            'pool_pre_ping': True,
-            'pool_recycle': 300,
-        }
+    # Redis (optional) - shared cache for chunk embeddings and background PDF processing
+    REDIS_URL = _ENV.get('REDIS_URL')
+    PDF_QUEUE_NAME = 'pdf-processing'
+    PDF_JOB_TIMEOUT = 600  # seconds
+    EMBEDDINGS_CACHE_TTL = 7 * 24 * 60 * 60  # seconds; cached vectors share Redis with sessions and the queue
     
     # Upload configuration
-    UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'pdf'}
+    INDEX_FOLDER = _ENV.get('INDEX_FOLDER', 'indexes')  # Persisted FAISS indexes, one directory per PDF
+    
+    # In-memory cache limits (vector stores are LRU, chat chains expire after inactivity)
+    VECTOR_STORE_CACHE_SIZE = int(_ENV.get('VECTOR_STORE_CACHE_SIZE', 16))
+    CHAIN_CACHE_SIZE = int(_ENV.get('CHAIN_CACHE_SIZE', 256))
+    CHAIN_CACHE_TTL = 30 * 60  # seconds
+    
+    # Embeddings configuration (quantized ONNX model is exported here on first run)
+    EMBEDDINGS_MODEL_DIR = _ENV.get('EMBEDDINGS_MODEL_DIR', 'onnx_models/all-MiniLM-L6-v2-int8')
     
     # Session configuration
     SESSION_COOKIE_SECURE = True
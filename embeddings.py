@@ -0,0 +1,120 @@
+"""
+Sentence embeddings served from an INT8-quantized ONNX Runtime session
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+QUANTIZED_MODEL_FILE = "model_optimized_quantized.onnx"
+MAX_SEQ_LENGTH = 256  # Same limit sentence-transformers uses for MiniLM
+
+
+def export_quantized_model(model_dir, model_name=MODEL_NAME):
+    """Export the model to ONNX, optimize the graph and quantize it to INT8 (one-time)"""
+    if os.path.exists(os.path.join(model_dir, QUANTIZED_MODEL_FILE)):
+        return model_dir
+
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTOptimizer, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+    from transformers import AutoTokenizer
+
+    print(f"Exporting {model_name} to quantized ONNX (one-time setup)...")
+    # Build everything in a scratch directory next to model_dir and rename it into place at the end,
+    # so an interrupted or concurrent export never leaves a half-written model_dir behind
+    parent_dir = os.path.dirname(os.path.abspath(model_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(model_dir)}-", dir=parent_dir)
+    try:
+        optimized_dir = os.path.join(build_dir, "optimized")
+
+        # Export PyTorch weights to ONNX and fuse the graph
+        model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+        optimizer = ORTOptimizer.from_pretrained(model)
+        optimizer.optimize(
+            save_dir=optimized_dir,
+            optimization_config=OptimizationConfig(optimization_level=99)
+        )
+
+        # Dynamic INT8 quantization (VNNI dot products on modern x86)
+        quantizer = ORTQuantizer.from_pretrained(optimized_dir, file_name="model_optimized.onnx")
+        quantizer.quantize(
+            save_dir=build_dir,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=True)
+        )
+
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(build_dir)
+        shutil.rmtree(optimized_dir)
+
+        if os.path.isdir(model_dir) and not os.path.exists(os.path.join(model_dir, QUANTIZED_MODEL_FILE)):
+            shutil.rmtree(model_dir)  # Leftover of an export interrupted by an older version
+        try:
+            os.rename(build_dir, model_dir)
+        except OSError:
+            # Another process finished its export first, use that one
+            if not os.path.exists(os.path.join(model_dir, QUANTIZED_MODEL_FILE)):
+                raise
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    print("✓ Quantized model exported")
+    return model_dir
+
+
+class QuantizedEmbeddings(Embeddings):
+    """LangChain embeddings backed by a quantized MiniLM ONNX model"""
+
+    def __init__(self, model_dir, batch_size=32):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        export_quantized_model(model_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, QUANTIZED_MODEL_FILE),
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.batch_size = batch_size
+
+    def _encode(self, texts):
+        """Tokenize, run the session, mean-pool and L2-normalize"""
+        batch = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=MAX_SEQ_LENGTH,
+            return_tensors="np"
+        )
+        inputs = {name: value for name, value in batch.items() if name in self.input_names}
+        token_embeddings = self.session.run(None, inputs)[0]
+
+        # Mean pooling over real tokens only
+        mask = batch["attention_mask"][..., np.newaxis].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        pooled = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts):
+        """Embed a list of documents in length-sorted batches to minimize padding"""
+        if not texts:
+            return []
+
+        # Similar-length texts share a batch, so little compute is spent on padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch_ids = order[start:start + self.batch_size]
+            encoded = self._encode([texts[i] for i in batch_ids])
+            for i, vector in zip(batch_ids, encoded.tolist()):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text):
+        """Embed a single query"""
+        return self._encode([text])[0].tolist()
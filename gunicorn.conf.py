@@ -0,0 +1,21 @@
+"""
+Gunicorn configuration
+Picked up automatically from the working directory by `gunicorn app:app`
+"""
+
+# Import the app once in the master so workers share it copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    """Export the quantized embeddings model once, before any worker is forked"""
+    from app import app
+    from embeddings import export_quantized_model
+    export_quantized_model(app.config['EMBEDDINGS_MODEL_DIR'])
+
+
+def post_fork(server, worker):
+    """Load the embeddings model in each worker so the first request doesn't pay for it"""
+    # ONNX Runtime sessions don't survive fork, so each worker opens its own
+    from app import get_embeddings_model
+    get_embeddings_model()
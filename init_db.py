@@ -1,18 +1,132 @@
 """
 Database initialization script
 Run this script once to create all database tables
+(run it again after upgrading to bring existing tables up to date)
 """
 
-from app import app
-from models import db
+from sqlalchemy.schema import CreateTable
+from app import app, TEXT_SPLITTER
+from models import db, utcnow, PDFChunk
+
+
+def timestamp_columns(table):
+    """Names of the columns whose default is the database's UTC time"""
+    return [column.name for column in table.columns
+            if column.server_default is not None and isinstance(column.server_default.arg, utcnow)]
+
+
+def rebuild_sqlite_table(conn, table):
+    """Recreate a SQLite table from the current model and copy its rows over (SQLite can't alter defaults)"""
+    # Resolve foreign keys against a scratch copy of the schema, the new table must not join db.metadata
+    scratch = db.MetaData()
+    for other in db.metadata.sorted_tables:
+        other.to_metadata(scratch)
+    new_table = table.to_metadata(scratch, name=f'{table.name}_new')
+    
+    existing = {column['name'] for column in db.inspect(conn).get_columns(table.name)}
+    columns = [column.name for column in table.columns if column.name in existing]
+    stamped = timestamp_columns(table)
+    # Rows inserted while the column had no default are NULL; date them now rather than 1970
+    column_list = ', '.join(f'"{name}"' for name in columns)
+    selected = ', '.join(f'COALESCE("{name}", CURRENT_TIMESTAMP)' if name in stamped else f'"{name}"' for name in columns)
+    
+    # Standard SQLite rebuild: create new, copy, drop old, rename (foreign key enforcement is off
+    # on these connections, so dropping a parent table doesn't touch its children)
+    conn.execute(CreateTable(new_table))
+    conn.exec_driver_sql(
+        f'INSERT INTO "{new_table.name}" ({column_list}) SELECT {selected} FROM "{table.name}"'
+    )
+    conn.exec_driver_sql(f'DROP TABLE "{table.name}"')
+    conn.exec_driver_sql(f'ALTER TABLE "{new_table.name}" RENAME TO "{table.name}"')
+
+
+def upgrade_schema(conn):
+    """Bring tables created by earlier versions up to the current models (create_all skips existing tables)"""
+    inspector = db.inspect(conn)
+    api_key_columns = {column['name'] for column in inspector.get_columns('api_keys')}
+    pdf_columns = {column['name'] for column in inspector.get_columns('pdf_documents')}
+    
+    # Masked key is saved with the key now; older rows fall back to decrypting for display
+    if 'masked_key' not in api_key_columns:
+        conn.exec_driver_sql("ALTER TABLE api_keys ADD COLUMN masked_key VARCHAR(20)")
+    
+    # The FAISS index lives in INDEX_FOLDER now (rebuilt from the chunks on first select)
+    if 'vector_store_path' not in pdf_columns:
+        conn.exec_driver_sql("ALTER TABLE pdf_documents ADD COLUMN vector_store_path VARCHAR(512)")
+    if 'vector_store_data' in pdf_columns:
+        conn.exec_driver_sql("ALTER TABLE pdf_documents DROP COLUMN vector_store_data")
+    
+    # Extracted text lives in pdf_chunks now; split the stored text into chunks before dropping it
+    if 'text_content' in pdf_columns:
+        rows = conn.execute(db.text(
+            "SELECT id, text_content FROM pdf_documents WHERE text_content IS NOT NULL"
+        )).all()
+        for pdf_id, text in rows:
+            chunks = TEXT_SPLITTER.split_text(text)
+            if chunks:
+                conn.execute(db.insert(PDFChunk), [
+                    {'pdf_id': pdf_id, 'chunk_idx': i, 'text': chunk, 'embedding_offset': i}
+                    for i, chunk in enumerate(chunks)
+                ])
+        conn.exec_driver_sql("ALTER TABLE pdf_documents DROP COLUMN text_content")
+        print(f"  Moved the text of {len(rows)} PDF(s) into pdf_chunks")
+    
+    if conn.dialect.name == 'postgresql':
+        # API keys used to be stored as base64 text; keep existing values as their raw bytes
+        data_type = conn.exec_driver_sql(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = 'api_keys' AND column_name = 'key_value_encrypted'"
+        ).scalar()
+        if data_type == 'text':
+            conn.exec_driver_sql(
+                "ALTER TABLE api_keys ALTER COLUMN key_value_encrypted TYPE bytea "
+                "USING convert_to(key_value_encrypted, 'UTF8')"
+            )
+        
+        # Timestamps are assigned by the database now; older tables have no default
+        # (and rows inserted meanwhile have NULL timestamps, date them now)
+        utc_default = utcnow().compile(dialect=conn.dialect)
+        quote = conn.dialect.identifier_preparer
+        for table in db.metadata.sorted_tables:
+            for name in timestamp_columns(table):
+                column = quote.quote(name)
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {quote.format_table(table)} ALTER COLUMN {column} SET DEFAULT {utc_default}"
+                )
+                conn.exec_driver_sql(
+                    f"UPDATE {quote.format_table(table)} SET {column} = DEFAULT WHERE {column} IS NULL"
+                )
+    elif conn.dialect.name == 'sqlite':
+        # SQLite can't change a column default in place, so rebuild the tables created without one
+        inspector = db.inspect(conn)  # Fresh inspector, the columns changed above
+        for table in db.metadata.sorted_tables:
+            defaults = {column['name']: column['default'] for column in inspector.get_columns(table.name)}
+            if any(defaults.get(name) is None for name in timestamp_columns(table)):
+                rebuild_sqlite_table(conn, table)
+                print(f"  Rebuilt {table.name} with timestamp defaults")
+    
+    # Replaced by ix_chat_user_time
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_chat_messages_timestamp")
+    
+    # Indexes added since the tables were created
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
 
 def init_database():
     """Initialize the database with all tables"""
     with app.app_context():
         print("Creating database tables...")
         
-        # Create all tables
-        db.create_all()
+        # Create all tables and indexes, and upgrade existing ones, in a single transaction
+        with db.engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                # One-shot bootstrap, no need to wait for a WAL flush per statement
+                conn.exec_driver_sql("SET LOCAL synchronous_commit = off")
+                conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            db.metadata.create_all(bind=conn, checkfirst=True)
+            upgrade_schema(conn)
         
         print("✓ Database tables created successfully!")
         print("\nTables created:")
@@ -20,6 +134,7 @@ def init_database():
         print("  - api_keys")
         print("  - chat_messages")
         print("  - pdf_documents")
+        print("  - pdf_chunks")
         print("\nYou can now run the application with: python app.py")
 
 if __name__ == '__main__':
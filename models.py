@@ -1,60 +1,119 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.orm import Mapped, mapped_column
 from flask_login import UserMixin
 from flask_bcrypt import Bcrypt
-from datetime import datetime
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.exceptions import InvalidTag
 import os
+import base64
+import sqlite3
+from datetime import datetime
+from typing import List, Optional
+from config import get_or_create_secret
 
 db = SQLAlchemy()
-bcrypt = Bcrypt()
+bcrypt = Bcrypt()  # Only used to verify legacy hashes
+password_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=2)
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _):
+    """Use WAL and memory-mapped I/O on SQLite connections (no-op for PostgreSQL)"""
+    if isinstance(dbapi_conn, sqlite3.Connection):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, fsyncs at checkpoints only
+        cur.execute("PRAGMA mmap_size=268435456")  # 256MB
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA cache_size=-65536")  # 64MB
+        cur.close()
+
+
+class utcnow(FunctionElement):
+    """Current UTC time as a naive timestamp, evaluated by the database"""
+    type = db.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"  # Already UTC on SQLite
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    # now() is in the session time zone; timestamp columns have none, so convert to UTC explicitly
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
 
-# Generate or use a fixed encryption key for API keys
-# In production, store this securely in environment variables
 def get_encryption_key():
-    """Get or generate encryption key, ensuring it's bytes"""
-    key = os.getenv('ENCRYPTION_KEY')
-    if key:
-        # If key is provided, ensure it's bytes
-        return key.encode() if isinstance(key, str) else key
-    else:
-        # Generate a new key and print warning
-        new_key = Fernet.generate_key()
-        print("\n" + "="*70)
-        print("⚠️  WARNING: No ENCRYPTION_KEY found in .env file!")
-        print("="*70)
-        print("A temporary encryption key has been generated for this session.")
-        print("Add this to your .env file to persist encrypted API keys:")
-        print(f"\nENCRYPTION_KEY={new_key.decode()}\n")
-        print("Without this, you'll need to re-add your API keys on restart.")
-        print("="*70 + "\n")
-        return new_key
+    """Get the encryption key as bytes (from ENCRYPTION_KEY, else generated once and kept in SECRETS_FOLDER)"""
+    return get_or_create_secret('ENCRYPTION_KEY', lambda: Fernet.generate_key().decode()).encode()
 
 ENCRYPTION_KEY = get_encryption_key()
-cipher_suite = Fernet(ENCRYPTION_KEY)
+_RAW_KEY = base64.urlsafe_b64decode(ENCRYPTION_KEY)
+# AES-256-GCM with its own key derived from ENCRYPTION_KEY, Fernet keeps using the raw bytes (created once per process)
+cipher = AESGCM(HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'api-keys-aesgcm').derive(_RAW_KEY))
+legacy_gcm_cipher = AESGCM(_RAW_KEY)  # Decrypts keys stored before the GCM key was derived
+legacy_cipher_suite = Fernet(ENCRYPTION_KEY)  # Decrypts keys stored before the AES-GCM switch
+NONCE_SIZE = 12
+
+
+def encrypt_value(value):
+    """Encrypt a string with AES-GCM, returning nonce || ciphertext || tag"""
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + cipher.encrypt(nonce, value.encode(), None)
+
+
+def decrypt_value(data, aead=cipher):
+    """Decrypt nonce || ciphertext || tag produced by encrypt_value"""
+    return aead.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], None).decode()
 
 
 class User(UserMixin, db.Model):
     """User model for authentication"""
     __tablename__ = 'users'
     
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False, index=True)
-    email = db.Column(db.String(120), unique=True, nullable=False, index=True)
-    password_hash = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    username: Mapped[str] = mapped_column(db.String(80), unique=True, index=True)
+    email: Mapped[str] = mapped_column(db.String(120), unique=True, index=True)
+    password_hash: Mapped[str] = mapped_column(db.String(255))
+    created_at: Mapped[Optional[datetime]] = mapped_column(server_default=utcnow())
     
-    # Relationships
-    api_keys = db.relationship('APIKey', backref='user', lazy=True, cascade='all, delete-orphan')
-    chat_messages = db.relationship('ChatMessage', backref='user', lazy=True, cascade='all, delete-orphan')
-    pdf_documents = db.relationship('PDFDocument', backref='user', lazy=True, cascade='all, delete-orphan')
+    # Relationships (queried explicitly by user_id; raise instead of lazy loading to catch N+1 queries)
+    api_keys: Mapped[List['APIKey']] = db.relationship('APIKey', backref='user', lazy='raise_on_sql', cascade='all, delete-orphan')
+    chat_messages: Mapped[List['ChatMessage']] = db.relationship('ChatMessage', backref='user', lazy='raise_on_sql', cascade='all, delete-orphan')
+    pdf_documents: Mapped[List['PDFDocument']] = db.relationship('PDFDocument', backref='user', lazy='raise_on_sql', cascade='all, delete-orphan')
     
     def set_password(self, password):
-        """Hash and set the user password"""
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        """Hash and set the user password (Argon2id)"""
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        """Check if the provided password matches the hash"""
-        return bcrypt.check_password_hash(self.password_hash, password)
+        """Check if the provided password matches the hash, upgrading old hashes (caller commits)"""
+        if not self.password_hash.startswith('$argon2'):
+            # Legacy bcrypt hash, rehash with Argon2 once the password is known to be right
+            if not bcrypt.check_password_hash(self.password_hash, password):
+                return False
+            self.set_password(password)
+            return True
+        
+        try:
+            password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        if password_hasher.check_needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -63,29 +122,67 @@ class User(UserMixin, db.Model):
 class APIKey(db.Model):
     """API Key model for storing Groq API keys"""
     __tablename__ = 'api_keys'
+    __table_args__ = (
+        # At most one active key per user
+        db.Index('uq_apikey_active_per_user', 'user_id', unique=True,
+                 postgresql_where=db.text('is_active'), sqlite_where=db.text('is_active')),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(db.ForeignKey('users.id'), index=True)
+    key_value_encrypted: Mapped[bytes] = mapped_column(db.LargeBinary)  # Raw nonce || ciphertext || tag
+    label: Mapped[str] = mapped_column(db.String(100))
+    is_active: Mapped[Optional[bool]] = mapped_column(default=False)
+    masked_key: Mapped[Optional[str]] = mapped_column(db.String(20))  # Display form, saved with the key
+    created_at: Mapped[Optional[datetime]] = mapped_column(server_default=utcnow())
     
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    key_value_encrypted = db.Column(db.Text, nullable=False)
-    label = db.Column(db.String(100), nullable=False)
-    is_active = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    _plaintext_cache = None  # Decrypted key, memoized per instance
+    
+    @staticmethod
+    def mask_key(key):
+        """Mask an API key for display"""
+        if len(key) > 8:
+            return f"{key[:4]}...{key[-4:]}"
+        return "****"
     
     def set_key_value(self, key_value):
         """Encrypt and store the API key"""
-        self.key_value_encrypted = cipher_suite.encrypt(key_value.encode()).decode()
+        self.key_value_encrypted = encrypt_value(key_value)
+        self.masked_key = self.mask_key(key_value)
+        self._plaintext_cache = key_value
     
     def get_key_value(self):
         """Decrypt and return the API key"""
-        return cipher_suite.decrypt(self.key_value_encrypted.encode()).decode()
+        if self._plaintext_cache is None:
+            data = self.key_value_encrypted
+            if isinstance(data, str):
+                data = data.encode()  # Row written while the column was still text
+            data = bytes(data)
+            try:
+                self._plaintext_cache = decrypt_value(data)
+            except (InvalidTag, ValueError):
+                self._plaintext_cache = self._decrypt_legacy(data)
+        return self._plaintext_cache
+    
+    @staticmethod
+    def _decrypt_legacy(data):
+        """Decrypt keys from older versions: AES-GCM under the raw key (as bytes or base64 text), or a Fernet token"""
+        try:
+            return decrypt_value(data, legacy_gcm_cipher)
+        except (InvalidTag, ValueError):
+            pass
+        try:
+            return decrypt_value(base64.urlsafe_b64decode(data), legacy_gcm_cipher)
+        except (InvalidTag, ValueError):
+            return legacy_cipher_suite.decrypt(data).decode()
     
     def get_masked_key(self):
         """Return a masked version of the API key for display"""
+        if self.masked_key:
+            return self.masked_key
+        # Keys saved before masked_key existed still need a decrypt
         try:
-            key = self.get_key_value()
-            if len(key) > 8:
-                return f"{key[:4]}...{key[-4:]}"
-            return "****"
+            return self.mask_key(self.get_key_value())
         except:
             return "****"
     
@@ -96,18 +193,29 @@ class APIKey(db.Model):
 class ChatMessage(db.Model):
     """Chat message model for storing conversation history"""
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        # History by user, newest first (id breaks ties between messages saved in one transaction)
+        db.Index('ix_chat_user_time', 'user_id', db.text('timestamp DESC'), db.text('id DESC')),
+        db.CheckConstraint("role IN ('user', 'assistant')", name='ck_chat_role'),
+    )
     
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
-    message = db.Column(db.Text, nullable=False)
-    language = db.Column(db.String(50), default='English')
-    pdf_name = db.Column(db.String(255), nullable=True)  # Name of PDF if context-based
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(db.ForeignKey('users.id'))
+    role: Mapped[str] = mapped_column(db.String(20))  # 'user' or 'assistant'
+    message: Mapped[str] = mapped_column(db.Text)
+    language: Mapped[Optional[str]] = mapped_column(db.String(50), default='English')
+    pdf_name: Mapped[Optional[str]] = mapped_column(db.String(255))  # Name of PDF if context-based
+    timestamp: Mapped[Optional[datetime]] = mapped_column(server_default=utcnow())
     
     def __repr__(self):
         return f'<ChatMessage {self.role} at {self.timestamp}>'
     
+    @classmethod
+    def bulk_add(cls, rows):
+        """Insert many messages (plain dicts) in one executemany round-trip; caller commits"""
+        if rows:
+            db.session.execute(db.insert(cls), rows)
+    
     def to_dict(self):
         """Convert message to dictionary for JSON serialization"""
         return {
@@ -116,29 +224,54 @@ class ChatMessage(db.Model):
             'message': self.message,
             'language': self.language,
             'pdf_name': self.pdf_name,
-            'timestamp': self.timestamp.isoformat()
+            'timestamp': self.timestamp
         }
 
 
 class PDFDocument(db.Model):
     """PDF Document model for storing uploaded PDFs with vector embeddings"""
     __tablename__ = 'pdf_documents'
+    __table_args__ = (
+        db.Index('ix_pdf_user_active', 'user_id', 'is_active', 'uploaded_at'),  # Active PDF lookup per user
+        # At most one active PDF per user
+        db.Index('uq_pdf_active_per_user', 'user_id', unique=True,
+                 postgresql_where=db.text('is_active'), sqlite_where=db.text('is_active')),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(db.ForeignKey('users.id'))
+    filename: Mapped[str] = mapped_column(db.String(255))
+    original_filename: Mapped[str] = mapped_column(db.String(255))
+    file_size: Mapped[int] = mapped_column()  # in bytes
+    page_count: Mapped[Optional[int]] = mapped_column()
+    vector_store_path: Mapped[Optional[str]] = mapped_column(db.String(512))  # Directory of the persisted FAISS index
+    is_active: Mapped[Optional[bool]] = mapped_column(default=True)  # Currently selected PDF
+    uploaded_at: Mapped[Optional[datetime]] = mapped_column(server_default=utcnow(), index=True)
+    last_accessed: Mapped[Optional[datetime]] = mapped_column(server_default=utcnow())
     
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    filename = db.Column(db.String(255), nullable=False)
-    original_filename = db.Column(db.String(255), nullable=False)
-    file_size = db.Column(db.Integer, nullable=False)  # in bytes
-    page_count = db.Column(db.Integer, nullable=True)
-    text_content = db.Column(db.Text, nullable=False)  # Extracted text
-    vector_store_data = db.Column(db.LargeBinary, nullable=True)  # Serialized FAISS index
-    is_active = db.Column(db.Boolean, default=True)  # Currently selected PDF
-    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    last_accessed = db.Column(db.DateTime, default=datetime.utcnow)
+    # Text chunks (read in bulk through get_chunk_texts, never per row)
+    chunks: Mapped[List['PDFChunk']] = db.relationship('PDFChunk', backref='pdf', lazy='raise_on_sql', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<PDFDocument {self.filename}>'
     
+    def save_chunks(self, chunks):
+        """Store the text chunks in one bulk INSERT; caller commits"""
+        db.session.execute(db.insert(PDFChunk), [
+            {'pdf_id': self.id, 'chunk_idx': i, 'text': chunk, 'embedding_offset': i}
+            for i, chunk in enumerate(chunks)
+        ])
+    
+    def get_chunk_texts(self):
+        """Return the text chunks in order, without loading full ORM objects"""
+        return db.session.scalars(
+            db.select(PDFChunk.text).where(PDFChunk.pdf_id == self.id).order_by(PDFChunk.chunk_idx)
+        ).all()
+    
+    def delete_chunks(self):
+        """Delete the text chunks in one statement; caller commits"""
+        db.session.execute(db.delete(PDFChunk).where(PDFChunk.pdf_id == self.id))
+    
     def to_dict(self):
         """Convert PDF to dictionary for JSON serialization"""
         return {
@@ -148,6 +281,33 @@ class PDFDocument(db.Model):
             'file_size': self.file_size,
             'page_count': self.page_count,
             'is_active': self.is_active,
-            'uploaded_at': self.uploaded_at.isoformat(),
-            'last_accessed': self.last_accessed.isoformat()
+            'uploaded_at': self.uploaded_at,
+            'last_accessed': self.last_accessed
         }
+
+
+class PDFChunk(db.Model):
+    """Text chunk of a PDF, in the same order as its vectors in the FAISS index"""
+    __tablename__ = 'pdf_chunks'
+    __table_args__ = (
+        db.Index('ix_pdfchunk_pdf', 'pdf_id', 'chunk_idx'),
+        # Trigram index so substring search (LIKE/ILIKE) over chunk text is an index lookup
+        db.Index('ix_pdfchunk_text_trgm', 'text', postgresql_using='gin',
+                 postgresql_ops={'text': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    pdf_id: Mapped[int] = mapped_column(db.ForeignKey('pdf_documents.id', ondelete='CASCADE'))
+    chunk_idx: Mapped[int] = mapped_column()
+    text: Mapped[str] = mapped_column(db.Text)
+    embedding_offset: Mapped[int] = mapped_column()  # Position of the vector in the FAISS index
+    
+    def __repr__(self):
+        return f'<PDFChunk {self.pdf_id}:{self.chunk_idx}>'
+
+
+# gin_trgm_ops comes from the pg_trgm extension, which has to exist before the index
+event.listen(
+    PDFChunk.__table__, 'before_create',
+    db.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
@@ -0,0 +1,15 @@
+"""
+PDF text extraction run inside worker processes
+(kept free of app imports so extraction workers start without loading Flask, LangChain or the model)
+"""
+
+import pypdfium2 as pdfium
+
+
+def extract_page_range(pdf_path, start, stop):
+    """Extract text of pages [start, stop) in its own pdfium document"""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return [pdf[i].get_textpage().get_text_range() for i in range(start, stop)]
+    finally:
+        pdf.close()